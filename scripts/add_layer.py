@@ -2,7 +2,7 @@
 project = QgsProject.instance()
 
 # Lag variabel med koordinatsystem
-crs = QgsCoordinateReferenceSystem("EPSG:4258")
+crs = QgsCoordinateReferenceSystem.fromEpsgId(4258)
 
 # Sett koordinatsystem for hele prosjektet
 project.setCrs(crs)
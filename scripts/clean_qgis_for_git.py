@@ -7,11 +7,62 @@ It specifically removes database passwords and other credentials that might be s
 """
 
 import os
+import re
+import mmap
+import json
 import sys
-import glob
 import lxml.etree as ET
 import argparse
-from typing import List, Optional
+import concurrent.futures
+from typing import Dict, Iterator, List, Optional
+
+# Matches a password value in a connection string: quoted (with escapes) or up to the next whitespace
+PASSWORD_PATTERN = re.compile(r"password=(?:'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|\S+)")
+
+# Matches a non-empty password, quoted or unquoted, so cleaned placeholders such as password='' do not
+NONEMPTY_PASSWORD_PATTERN = re.compile(r"""password=(?:'[^']|"[^"]|[^'"\s])""")
+
+# The same check on the raw file bytes, where quotes may also be written as XML entities
+NONEMPTY_PASSWORD_BYTES_PATTERN = re.compile(
+    rb"""password=(?:'[^']|"[^"]|&apos;(?!&apos;)|&quot;(?!&quot;)|&(?!apos;|quot;)|[^'"&\s<])""")
+
+# Shared parser for project files: no xml:id table is needed for the rewrite.
+# Whitespace is kept so cleaned files stay diff-friendly in Git.
+QGIS_PARSER = ET.XMLParser(collect_ids=False, huge_tree=False)
+
+# Selects only datasources holding a password, with the predicate evaluated inside libxml2
+PASSWORD_DATASOURCES = ET.XPath(".//datasource[contains(text(), 'password=')]")
+
+# Records the (mtime, size) at which each file was last known to be clean, so unchanged files can be skipped
+CLEAN_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.qgs_clean_cache.json')
+
+
+def walk_qgis_files(directory: str) -> Iterator[str]:
+    """
+    Yield QGIS project files below a directory using an iterative os.scandir walk.
+    
+    Hidden files and directories are skipped, matching the behaviour of glob.
+    
+    Args:
+        directory (str): Directory path to search in
+        
+    Yields:
+        str: Path to each QGIS project file found
+    """
+    stack = [directory]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith('.qgs'):
+                    yield entry.path
 
 
 def find_qgis_files(directory: str) -> List[str]:
@@ -24,11 +75,103 @@ def find_qgis_files(directory: str) -> List[str]:
     Returns:
         List[str]: List of absolute paths to QGIS project files
     """
-    pattern = os.path.join(directory, "**", "*.qgs")
-    return glob.glob(pattern, recursive=True)
+    return list(walk_qgis_files(directory))
+
+
+def contains_password_marker(qgis_file: str) -> bool:
+    """
+    Check the raw bytes of a file for a non-empty password without parsing any XML.
+    
+    Args:
+        qgis_file (str): Path to the QGIS project file
+        
+    Returns:
+        bool: True if the file contains a non-empty password anywhere
+    """
+    with open(qgis_file, 'rb') as f:
+        # mmap cannot map an empty file
+        if os.fstat(f.fileno()).st_size == 0:
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return NONEMPTY_PASSWORD_BYTES_PATTERN.search(mm) is not None
+
+
+def has_password_datasource(qgis_file: str) -> bool:
+    """
+    Stream through a QGIS project file looking for a datasource with a non-empty password.
+    
+    Each <datasource> element, and everything parsed before it, is discarded as
+    soon as it has been inspected, so memory use stays flat for large projects.
+    
+    Args:
+        qgis_file (str): Path to the QGIS project file
+        
+    Returns:
+        bool: True if at least one datasource contains a non-empty password
+    """
+    for _, datasource in ET.iterparse(qgis_file, events=('end',), tag='datasource',
+                                     collect_ids=False):
+        if datasource.text and NONEMPTY_PASSWORD_PATTERN.search(datasource.text):
+            return True
+        
+        # Drop the inspected element and all finished siblings along its ancestor chain
+        datasource.clear(keep_tail=True)
+        node = datasource
+        while node.getparent() is not None:
+            while node.getprevious() is not None:
+                del node.getparent()[0]
+            node = node.getparent()
+    return False
+
+
+def load_clean_cache(cache_file: str = CLEAN_CACHE_FILE) -> Dict[str, List[int]]:
+    """
+    Load the cache of files known to be free of passwords.
+    
+    Args:
+        cache_file (str): Path to the JSON cache file
+        
+    Returns:
+        Dict[str, List[int]]: Mapping of absolute file paths to [mtime_ns, size]
+    """
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_clean_cache(cache: Dict[str, List[int]], cache_file: str = CLEAN_CACHE_FILE) -> None:
+    """
+    Save the cache of files known to be free of passwords.
+    
+    Args:
+        cache (Dict[str, List[int]]): Mapping of absolute file paths to [mtime_ns, size]
+        cache_file (str): Path to the JSON cache file
+    """
+    try:
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+    except OSError as e:
+        print(f"Warning: Could not write clean cache {cache_file}: {str(e)}")
 
 
-def clean_passwords(qgis_file: str) -> bool:
+def file_signature(qgis_file: str) -> List[int]:
+    """
+    Get the modification time and size used to detect changed files.
+    
+    Args:
+        qgis_file (str): Path to the QGIS project file
+        
+    Returns:
+        List[int]: [mtime_ns, size] of the file
+    """
+    stat = os.stat(qgis_file)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def clean_passwords(qgis_file: str) -> Optional[bool]:
     """
     Remove passwords from a QGIS project file.
     
@@ -36,33 +179,46 @@ def clean_passwords(qgis_file: str) -> bool:
         qgis_file (str): Path to the QGIS project file
         
     Returns:
-        bool: True if passwords were cleaned, False otherwise
+        Optional[bool]: True if passwords were cleaned, False if there was nothing to clean,
+                        None if the file could not be processed
     """
     try:
-        tree = ET.parse(qgis_file)
+        # Most projects hold no passwords, or only cleaned ones, so skip XML parsing for those
+        if not contains_password_marker(qgis_file):
+            return False
+        
+        # Only build the full tree when there is something to clean
+        if not has_password_datasource(qgis_file):
+            return False
+        
+        tree = ET.parse(qgis_file, parser=QGIS_PARSER)
         root = tree.getroot()
         
-        datasources = root.findall('.//datasource')
         cleaned = False
         
         # Remove all passwords from the datasources
-        for datasource in datasources:
-            if datasource.text and 'password=' in datasource.text:
-                # Extract current password
-                password = datasource.text.split('password=')[1].split(' ')[0]
-                # Replace with empty password
-                datasource.text = datasource.text.replace(password, "''")
+        for datasource in PASSWORD_DATASOURCES(root):
+            # Replace every password with an empty one in a single scan
+            new_text = PASSWORD_PATTERN.sub("password=''", datasource.text)
+            if new_text != datasource.text:
+                datasource.text = new_text
                 cleaned = True
         
         if cleaned:
-            # Save the modified QGIS project file
-            tree.write(qgis_file, encoding='utf-8', xml_declaration=True)
+            # Save the modified QGIS project file atomically so an interrupted
+            # write never leaves a truncated project behind
+            # Serialize once and write the bytes in a single call
+            data = ET.tostring(tree, encoding='UTF-8', xml_declaration=True)
+            tmp_file = qgis_file + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_file, qgis_file)
             return True
         return False
     
     except Exception as e:
         print(f"Error cleaning {qgis_file}: {str(e)}")
-        return False
+        return None
 
 
 def main() -> int:
@@ -79,6 +235,10 @@ def main() -> int:
                         help="Show verbose output")
     parser.add_argument("-f", "--file", 
                         help="Process a specific QGIS file instead of searching a directory")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of files to clean in parallel (default: number of CPUs)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Check every file, even those unchanged since they were last found clean")
     
     args = parser.parse_args()
     
@@ -96,13 +256,35 @@ def main() -> int:
     if args.verbose:
         print(f"Found {len(qgis_files)} QGIS project files")
     
-    # Clean each file
+    # Skip files that have not changed since they were last found clean; with --no-cache every file
+    # is checked, but the results are still merged into the cache so other files keep their entries
+    cache = load_clean_cache()
+    if args.no_cache:
+        pending_files = qgis_files
+    else:
+        pending_files = [qgis_file for qgis_file in qgis_files
+                         if cache.get(os.path.abspath(qgis_file)) != file_signature(qgis_file)]
+    
+    if args.verbose and len(pending_files) < len(qgis_files):
+        print(f"Skipping {len(qgis_files) - len(pending_files)} unchanged files already known to be clean")
+    
+    # Clean the files in parallel, reporting each one as it finishes
     cleaned_count = 0
-    for qgis_file in qgis_files:
-        if clean_passwords(qgis_file):
-            cleaned_count += 1
-            if args.verbose:
-                print(f"Cleaned passwords from {qgis_file}")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {executor.submit(clean_passwords, qgis_file): qgis_file for qgis_file in pending_files}
+        for future in concurrent.futures.as_completed(futures):
+            qgis_file = futures[future]
+            result = future.result()
+            if result is None:
+                continue
+            # The file is clean now, whether or not it had to be rewritten
+            cache[os.path.abspath(qgis_file)] = file_signature(qgis_file)
+            if result:
+                cleaned_count += 1
+                if args.verbose:
+                    print(f"Cleaned passwords from {qgis_file}")
+    
+    save_clean_cache(cache)
     
     print(f"Cleaned {cleaned_count} of {len(qgis_files)} files")
     
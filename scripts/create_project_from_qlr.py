@@ -18,6 +18,9 @@ Date: September 2025
 
 import os
 import re
+from bisect import bisect_left
+from collections import defaultdict
+from operator import itemgetter
 from pathlib import Path
 from qgis.core import (
     QgsProject, 
@@ -32,11 +35,41 @@ QLR_FOLDER = "./data/topo_layers"
 OUTPUT_PROJECT = "./data/topo_from_qlr.qgs"
 DEFAULT_CRS = "EPSG:25833"  # Norwegian coordinate system (UTM zone 33)
 
+# Layer number in lag{number}_{name}.qlr, or the old {number}_{name}.qlr pattern for backward compatibility
+LAYER_NUMBER_PATTERN = re.compile(r'^(?:lag)?(\d+)_')
+
+# Layer categories for preview_layer_structure as (highest layer number, label), lowest numbers first
+LAYER_CATEGORIES = [
+    (10, 'Base Layers (1-10) - Load Last (Top of Tree)'),
+    (27, 'Infrastructure (11-27) - Load Third'),
+    (42, 'Text/Names (28-42) - Load Second'),
+    (44, 'Arctic Territories (43-44) - Load First (Bottom of Tree)'),
+]
+LAYER_CATEGORY_BOUNDS = [upper for upper, _ in LAYER_CATEGORIES]
+
+# Messages collected while create_project_from_qlr runs, or None when logging directly
+LOG_BUFFER = None
+
 def log_message(message, level=Qgis.Info):
-    """Log message to QGIS message log"""
+    """Log message to QGIS message log, buffering it while a project is being created"""
+    if LOG_BUFFER is not None:
+        if level != Qgis.Critical:
+            LOG_BUFFER.append((message, level))
+            return
+        # Critical messages are shown immediately, after anything logged before them
+        flush_log_buffer()
     QgsMessageLog.logMessage(message, "QLR to Project", level)
     print(f"[QLR to Project] {message}")
 
+def flush_log_buffer():
+    """Write buffered messages to the QGIS message log and stdout in one go"""
+    if not LOG_BUFFER:
+        return
+    level = Qgis.Warning if any(lvl == Qgis.Warning for _, lvl in LOG_BUFFER) else Qgis.Info
+    QgsMessageLog.logMessage("\n".join(message for message, _ in LOG_BUFFER), "QLR to Project", level)
+    print("\n".join(f"[QLR to Project] {message}" for message, _ in LOG_BUFFER))
+    LOG_BUFFER.clear()
+
 def get_layer_number(filename):
     """
     Extract layer number from filename for sorting
@@ -48,19 +81,12 @@ def get_layer_number(filename):
     Returns:
         int: Layer number for sorting, or 999999 if no number found
     """
-    # Match pattern: lag{number}_{name}.qlr
-    match = re.match(r'^lag(\d+)_', filename)
+    match = LAYER_NUMBER_PATTERN.match(filename)
     if match:
         return int(match.group(1))
-    else:
-        # Also try old pattern for backward compatibility: {number}_{name}.qlr
-        match_old = re.match(r'^(\d+)_', filename)
-        if match_old:
-            return int(match_old.group(1))
-        else:
-            # If no number found, put at end
-            log_message(f"Warning: No layer number found in filename: {filename}", Qgis.Warning)
-            return 999999
+    # If no number found, put at end
+    log_message(f"Warning: No layer number found in filename: {filename}", Qgis.Warning)
+    return 999999
 
 def find_qlr_files(folder_path):
     """
@@ -70,7 +96,7 @@ def find_qlr_files(folder_path):
         folder_path (str): Path to folder containing .qlr files
         
     Returns:
-        list: Sorted list of .qlr file paths
+        list: Sorted list of (layer number, .qlr file path) tuples
     """
     folder = Path(folder_path)
     
@@ -82,16 +108,18 @@ def find_qlr_files(folder_path):
         log_message(f"Error: Path is not a directory: {folder_path}", Qgis.Critical)
         return []
     
-    # Find all .qlr files
-    qlr_files = list(folder.glob("*.qlr"))
+    # Find all .qlr files and sort by layer number extracted from filename
+    # (reverse order - higher numbers first), extracting each number only once
+    qlr_files = sorted(
+        ((get_layer_number(qlr_file.name), qlr_file) for qlr_file in folder.glob("*.qlr")),
+        key=itemgetter(0),
+        reverse=True
+    )
     
     if not qlr_files:
         log_message(f"Warning: No .qlr files found in folder: {folder_path}", Qgis.Warning)
         return []
     
-    # Sort by layer number extracted from filename (reverse order - higher numbers first)
-    qlr_files.sort(key=lambda x: get_layer_number(x.name), reverse=True)
-    
     log_message(f"Found {len(qlr_files)} .qlr files in {folder_path}")
     
     return qlr_files
@@ -100,86 +128,93 @@ def create_project_from_qlr():
     """
     Main function to create QGIS project from .qlr files
     """
-    log_message("=== Starting QLR to Project Creation ===")
-    
-    # Get current project instance
-    project = QgsProject.instance()
-    
-    # Clear existing project
-    project.clear()
-    log_message("Cleared existing project")
-    
-    # Set project CRS
-    crs = QgsCoordinateReferenceSystem(DEFAULT_CRS)
-    if crs.isValid():
-        project.setCrs(crs)
-        log_message(f"Set project CRS to: {DEFAULT_CRS}")
-    else:
-        log_message(f"Warning: Invalid CRS: {DEFAULT_CRS}, using default", Qgis.Warning)
-    
-    # Find and sort .qlr files
-    qlr_files = find_qlr_files(QLR_FOLDER)
-    
-    if not qlr_files:
-        log_message("No .qlr files found. Aborting.", Qgis.Critical)
-        return False
-    
-    # Load each .qlr file
-    loaded_count = 0
-    failed_count = 0
-    
-    for qlr_file in qlr_files:
-        try:
-            log_message(f"Loading: {qlr_file.name}")
-            
-            # Load layer definition
-            result = QgsLayerDefinition.loadLayerDefinition(
-                str(qlr_file), 
-                project, 
-                project.layerTreeRoot()
-            )
-            
-            if result:
-                loaded_count += 1
-                log_message(f"✓ Successfully loaded: {qlr_file.name}")
-            else:
+    global LOG_BUFFER
+    LOG_BUFFER = []
+    try:
+        log_message("=== Starting QLR to Project Creation ===")
+        
+        # Get current project instance
+        project = QgsProject.instance()
+        
+        # Clear existing project
+        project.clear()
+        log_message("Cleared existing project")
+        
+        # Set project CRS
+        crs = QgsCoordinateReferenceSystem(DEFAULT_CRS)
+        if crs.isValid():
+            project.setCrs(crs)
+            log_message(f"Set project CRS to: {DEFAULT_CRS}")
+        else:
+            log_message(f"Warning: Invalid CRS: {DEFAULT_CRS}, using default", Qgis.Warning)
+        
+        # Find and sort .qlr files
+        qlr_files = find_qlr_files(QLR_FOLDER)
+        
+        if not qlr_files:
+            log_message("No .qlr files found. Aborting.", Qgis.Critical)
+            return False
+        
+        # Load each .qlr file
+        loaded_count = 0
+        failed_count = 0
+        tree_root = project.layerTreeRoot()
+        
+        for _, qlr_file in qlr_files:
+            try:
+                log_message(f"Loading: {qlr_file.name}")
+                
+                # Load layer definition
+                result = QgsLayerDefinition.loadLayerDefinition(
+                    str(qlr_file), 
+                    project, 
+                    tree_root
+                )
+                
+                if result:
+                    loaded_count += 1
+                    log_message(f"✓ Successfully loaded: {qlr_file.name}")
+                else:
+                    failed_count += 1
+                    log_message(f"✗ Failed to load: {qlr_file.name}", Qgis.Warning)
+                    
+            except Exception as e:
                 failed_count += 1
-                log_message(f"✗ Failed to load: {qlr_file.name}", Qgis.Warning)
+                log_message(f"✗ Exception loading {qlr_file.name}: {str(e)}", Qgis.Critical)
+        
+        # Summary
+        log_message(f"=== Loading Summary ===")
+        log_message(f"Successfully loaded: {loaded_count} layers")
+        log_message(f"Failed to load: {failed_count} layers")
+        log_message(f"Total layers in project: {len(project.mapLayers())}")
+        
+        # Save project if layers were loaded
+        if loaded_count > 0:
+            try:
+                # Ensure output directory exists
+                output_path = Path(OUTPUT_PROJECT)
+                output_path.parent.mkdir(parents=True, exist_ok=True)
                 
-        except Exception as e:
-            failed_count += 1
-            log_message(f"✗ Exception loading {qlr_file.name}: {str(e)}", Qgis.Critical)
-    
-    # Summary
-    log_message(f"=== Loading Summary ===")
-    log_message(f"Successfully loaded: {loaded_count} layers")
-    log_message(f"Failed to load: {failed_count} layers")
-    log_message(f"Total layers in project: {len(project.mapLayers())}")
-    
-    # Save project if layers were loaded
-    if loaded_count > 0:
-        try:
-            # Ensure output directory exists
-            output_path = Path(OUTPUT_PROJECT)
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            # Save project
-            result = project.write(OUTPUT_PROJECT)
-            
-            if result:
-                log_message(f"✓ Project saved successfully: {OUTPUT_PROJECT}")
-                log_message(f"=== Project Creation Complete ===")
-                return True
-            else:
-                log_message(f"✗ Failed to save project: {OUTPUT_PROJECT}", Qgis.Critical)
-                return False
+                # Save project
+                result = project.write(OUTPUT_PROJECT)
                 
-        except Exception as e:
-            log_message(f"✗ Exception saving project: {str(e)}", Qgis.Critical)
+                if result:
+                    log_message(f"✓ Project saved successfully: {OUTPUT_PROJECT}")
+                    log_message(f"=== Project Creation Complete ===")
+                    return True
+                else:
+                    log_message(f"✗ Failed to save project: {OUTPUT_PROJECT}", Qgis.Critical)
+                    return False
+                    
+            except Exception as e:
+                log_message(f"✗ Exception saving project: {str(e)}", Qgis.Critical)
+                return False
+        else:
+            log_message("No layers loaded, project not saved.", Qgis.Warning)
             return False
-    else:
-        log_message("No layers loaded, project not saved.", Qgis.Warning)
-        return False
+    finally:
+        flush_log_buffer()
+        LOG_BUFFER = None
 
 def list_qlr_files():
     """
@@ -194,8 +229,7 @@ def list_qlr_files():
         return
     
     log_message(f"Found {len(qlr_files)} .qlr files in order:")
-    for i, qlr_file in enumerate(qlr_files, 1):
-        layer_num = get_layer_number(qlr_file.name)
+    for i, (layer_num, qlr_file) in enumerate(qlr_files, 1):
         log_message(f"{i:3d}. lag{layer_num:02d} - {qlr_file.name}")
 
 def preview_layer_structure():
@@ -211,28 +245,21 @@ def preview_layer_structure():
         log_message("No .qlr files found.")
         return
     
-    # Group layers by categories for better overview (shown in load order)
-    categories = {
-        'Arctic Territories (43-44) - Load First (Bottom of Tree)': [],
-        'Text/Names (28-42) - Load Second': [],
-        'Infrastructure (11-27) - Load Third': [],
-        'Base Layers (1-10) - Load Last (Top of Tree)': []
-    }
-    
-    for qlr_file in qlr_files:
-        layer_num = get_layer_number(qlr_file.name)
-        layer_name = qlr_file.name.replace('.qlr', '').replace(f'lag{layer_num:02d}_', '')
-        
-        if 43 <= layer_num <= 44:
-            categories['Arctic Territories (43-44) - Load First (Bottom of Tree)'].append(f"lag{layer_num:02d}: {layer_name}")
-        elif 28 <= layer_num <= 42:
-            categories['Text/Names (28-42) - Load Second'].append(f"lag{layer_num:02d}: {layer_name}")
-        elif 11 <= layer_num <= 27:
-            categories['Infrastructure (11-27) - Load Third'].append(f"lag{layer_num:02d}: {layer_name}")
-        elif 1 <= layer_num <= 10:
-            categories['Base Layers (1-10) - Load Last (Top of Tree)'].append(f"lag{layer_num:02d}: {layer_name}")
-    
-    for category, layers in categories.items():
+    # Group layers by categories for better overview
+    categories = defaultdict(list)
+    
+    for layer_num, qlr_file in qlr_files:
+        if not 1 <= layer_num <= LAYER_CATEGORY_BOUNDS[-1]:
+            continue
+        # Slice off the 'lagNN_' (or legacy 'NN_') prefix and the '.qlr' suffix
+        name = qlr_file.name
+        layer_name = name[name.index('_') + 1:-len('.qlr')]
+        category = LAYER_CATEGORIES[bisect_left(LAYER_CATEGORY_BOUNDS, layer_num)][1]
+        categories[category].append(f"lag{layer_num:02d}: {layer_name}")
+    
+    # Show categories in load order (highest layer numbers first)
+    for _, category in reversed(LAYER_CATEGORIES):
+        layers = categories.get(category)
         if layers:
             log_message(f"\n{category}:")
             for layer in layers:
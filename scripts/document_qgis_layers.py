@@ -1,10 +1,63 @@
-import xml.etree.ElementTree as ET
+import lxml.etree as ET
 import gzip
+import io
 import argparse
+import csv
 import os
 import sys
 import re  # Add regex module for password sanitization
+from collections import Counter, defaultdict
+from datetime import datetime
+from urllib.parse import quote
 
+# Password patterns used by sanitize_datasource, compiled once
+# Pattern 1: password=value or pwd=value (quoted or unquoted)
+PASSWORD_PATTERN = re.compile(r'(password\s*=\s*[\'"]?)([^\'"\s]+)([\'"]?)', re.IGNORECASE)
+PWD_PATTERN = re.compile(r'(pwd\s*=\s*[\'"]?)([^\'"\s]+)([\'"]?)', re.IGNORECASE)
+# Pattern 2: URI format - username:password@host
+URI_PASSWORD_PATTERN = re.compile(r'(://[^:@]+:)([^@]+)(@)')
+# Pattern 3: PG connection string - host=X port=Y dbname=Z user=A password=B
+PG_PASSWORD_PATTERN = re.compile(r'(\spassword=)[^\s]*', re.IGNORECASE)
+
+# Characters that urllib.parse.quote would escape in a layer name (it leaves
+# letters, digits, "_.-~" and the default safe "/" untouched)
+NEEDS_QUOTE_PATTERN = re.compile(r'[^A-Za-z0-9_.\-~/]')
+
+# Read buffer used when decompressing .qgz projects
+QGZ_BUFFER_SIZE = 128 * 1024
+
+# Default QGIS Server used for legend links
+DEFAULT_LEGEND_BASE_URL = "https://topo-qgis.atkv3-dev.kartverket-intern.cloud/qgis/"
+DEFAULT_LEGEND_MAP_FILE = "/opt/qgis/Topo_2025.qgs"
+
+
+def build_legend_prefix(base_url=None, map_file=None):
+    """
+    Returns the GetLegendGraphic URL up to the LAYER parameter value, so a legend URL
+    is this prefix followed by the encoded layer name.
+    
+    Args:
+        base_url (str, optional): Custom base URL for the WMS service
+        map_file (str, optional): Custom path to the map file
+        
+    Returns:
+        str: GetLegendGraphic URL ending in "LAYER="
+    """
+    if base_url is None:
+        base_url = DEFAULT_LEGEND_BASE_URL
+    if map_file is None:
+        map_file = DEFAULT_LEGEND_MAP_FILE
+    
+    return f"{base_url}?MAP={map_file}&SERVICE=WMS&REQUEST=GetLegendGraphic&LAYERTITLE=False&LAYER="
+
+def quote_layer_name(layer_name):
+    """
+    URL encodes a layer name for the LAYER parameter, returning names that need
+    no escaping as they are without calling quote.
+    """
+    if NEEDS_QUOTE_PATTERN.search(layer_name) is None:
+        return layer_name
+    return quote(layer_name)
 
 # Fetch the Legend of a Layer 
 # example url call:https://topo-qgis.atkv3-dev.kartverket-intern.cloud/qgis/?MAP=/opt/qgis/Topo_2025.qgs&SERVICE=WMS&REQUEST=GetLegendGraphic&LAYERTITLE=False&LAYER=Topo
@@ -20,39 +73,42 @@ def getLegend(layer_name, base_url=None, map_file=None):
     Returns:
         str: Complete URL for GetLegendGraphic request
     """
-    if base_url is None:
-        base_url = "https://topo-qgis.atkv3-dev.kartverket-intern.cloud/qgis/"
-    if map_file is None:
-        map_file = "/opt/qgis/Topo_2025.qgs"
-    
     # URL encode the layer name to handle special characters
-    import urllib.parse
-    encoded_layer_name = urllib.parse.quote(layer_name)
-    
-    return f"{base_url}?MAP={map_file}&SERVICE=WMS&REQUEST=GetLegendGraphic&LAYERTITLE=False&LAYER={encoded_layer_name}"
+    return build_legend_prefix(base_url, map_file) + quote_layer_name(layer_name)
     
 
+def open_qgis_project(project_file_path):
+    """
+    Opens a QGIS project file (.qgs or .qgz) as a binary stream of its XML content.
+    .qgz projects are decompressed on the fly through a QGZ_BUFFER_SIZE read buffer
+    instead of gzip's small default reads.
+    Returns None if the file type is not supported.
+    """
+    if project_file_path.lower().endswith('.qgz'):
+        return io.BufferedReader(gzip.open(project_file_path, 'rb'), buffer_size=QGZ_BUFFER_SIZE)
+    if project_file_path.lower().endswith('.qgs'):
+        return open(project_file_path, 'rb')
+    return None
+
 def parse_qgis_project_xml(project_file_path):
     """
-    Parses a QGIS project file (.qgs or .qgz) and returns the XML root element.
+    Parses a QGIS project file (.qgs or .qgz) incrementally and extracts the layer documentation data.
+    Map layers are processed as soon as they have been parsed and then discarded, so the full
+    project tree is never kept in memory.
+    Returns a (layers_data, layer_tree) tuple, or None if the project could not be read or parsed.
     """
-    xml_content = None
     try:
-        if project_file_path.lower().endswith('.qgz'):
-            with gzip.open(project_file_path, 'rb') as f_in:
-                xml_content = f_in.read()
-        elif project_file_path.lower().endswith('.qgs'):
-            with open(project_file_path, 'rb') as f:
-                xml_content = f.read()
-        else:
+        project_stream = open_qgis_project(project_file_path)
+        if project_stream is None:
             print(f"Error: Unsupported file type: {project_file_path}. Please provide a .qgs or .qgz file.", file=sys.stderr)
             return None
-
-        if xml_content:
-            # Remove default namespace if present to simplify XPath queries
-            xml_content = xml_content.replace(b'xmlns="http://www.qgis.org/dtd"', b'')
-            root = ET.fromstring(xml_content)
-            return root
+        with project_stream:
+            if project_stream.peek(1):
+                # Parse straight from the stream; the {*} wildcard matches the tags with or
+                # without QGIS' default namespace, so the XML is never read into memory whole
+                events = ET.iterparse(project_stream, events=("start", "end"),
+                                      tag=("{*}layer-tree-group", "{*}maplayer"))
+                return extract_layer_documentation_data(events)
     except FileNotFoundError:
         print(f"Error: Project file not found at {project_file_path}", file=sys.stderr)
     except ET.ParseError as e:
@@ -61,21 +117,20 @@ def parse_qgis_project_xml(project_file_path):
         print(f"An error occurred while reading {project_file_path}: {e}", file=sys.stderr)
     return None
 
-def extract_layer_tree_structure(root):
+def extract_layer_tree_structure(layer_tree_root):
     """
-    Extracts the layer tree structure including groups and their layers.
+    Extracts the layer tree structure including groups and their layers from the
+    project's root layer-tree-group element.
     Returns a dictionary with group structure and a mapping of layer IDs to their groups.
     """
     layer_tree = {}
     layer_to_group = {}
 
-    # Find the layer tree root element
-    layer_tree_root = root.find(".//layer-tree-group")
-    if layer_tree_root is None:
-        return layer_tree, layer_to_group
-
-    # Process layer tree recursively
-    def process_group(group_element, parent_path=""):
+    # Walk the layer tree depth-first with an explicit stack of (group element, parent path),
+    # starting from the root group
+    stack = [(layer_tree_root, "")]
+    while stack:
+        group_element, parent_path = stack.pop()
         group_name = group_element.get("name", "")
         if not group_name:
             group_name = "Unnamed Group"
@@ -87,22 +142,21 @@ def extract_layer_tree_structure(root):
             layer_tree[current_path] = {"name": group_name, "layers": [], "groups": []}
         
         # Process child layers in this group
-        for layer_element in group_element.findall("./layer-tree-layer"):
+        for layer_element in group_element.iterchildren("{*}layer-tree-layer"):
             layer_id = layer_element.get("id", "")
             layer_name = layer_element.get("name", "")
             if layer_id:
                 layer_tree[current_path]["layers"].append({"id": layer_id, "name": layer_name})
                 layer_to_group[layer_id] = current_path
         
-        # Process nested groups
-        for child_group in group_element.findall("./layer-tree-group"):
+        # Process nested groups, pushed in reverse so they are visited in document order
+        child_groups = list(group_element.iterchildren("{*}layer-tree-group"))
+        for child_group in child_groups:
             child_group_name = child_group.get("name", "Unnamed Group")
             child_path = f"{current_path}/{child_group_name}"
             layer_tree[current_path]["groups"].append(child_path)
-            process_group(child_group, current_path)
-    
-    # Start processing from the root group
-    process_group(layer_tree_root)
+        for child_group in reversed(child_groups):
+            stack.append((child_group, current_path))
     
     return layer_tree, layer_to_group
 
@@ -113,41 +167,52 @@ def sanitize_datasource(datasource):
     """
     if not datasource or datasource == "N/A":
         return datasource
+
+    # Most datasources carry no credentials at all; skip the substitutions unless
+    # one of the patterns below could possibly match
+    folded = datasource.casefold()
+    if 'password' not in folded and 'pwd' not in folded and '@' not in datasource:
+        return datasource
         
     # Handle various password patterns in connection strings
-    # Pattern 1: password=value or pwd=value (quoted or unquoted)
-    sanitized = re.sub(r'(password\s*=\s*[\'"]?)([^\'"\s]+)([\'"]?)', r'\1[PASSWORD_REMOVED]\3', 
-                      datasource, flags=re.IGNORECASE)
-    sanitized = re.sub(r'(pwd\s*=\s*[\'"]?)([^\'"\s]+)([\'"]?)', r'\1[PASSWORD_REMOVED]\3', 
-                      sanitized, flags=re.IGNORECASE)
-    
-    # Pattern 2: URI format - username:password@host
-    sanitized = re.sub(r'(://[^:@]+:)([^@]+)(@)', r'\1[PASSWORD_REMOVED]\3', sanitized)
-    
-    # Pattern 3: PG connection string - host=X port=Y dbname=Z user=A password=B
-    sanitized = re.sub(r'(\spassword=)[^\s]*', r'\1[PASSWORD_REMOVED]', sanitized, flags=re.IGNORECASE)
+    sanitized = PASSWORD_PATTERN.sub(r'\1[PASSWORD_REMOVED]\3', datasource)
+    sanitized = PWD_PATTERN.sub(r'\1[PASSWORD_REMOVED]\3', sanitized)
+    sanitized = URI_PASSWORD_PATTERN.sub(r'\1[PASSWORD_REMOVED]\3', sanitized)
+    sanitized = PG_PASSWORD_PATTERN.sub(r'\1[PASSWORD_REMOVED]', sanitized)
     
     return sanitized
 
-def extract_layer_documentation_data(root):
+def extract_layer_documentation_data(events):
     """
     Extracts datasource and scale visibility for each map layer.
     Also includes group membership information.
+    
+    Args:
+        events: lxml iterparse events ("start"/"end") for layer-tree-group and maplayer elements
     """
     layers_data = []
-    if root is None:
-        return layers_data, {}
-    
-    # Extract layer tree structure first
-    layer_tree, layer_to_group = extract_layer_tree_structure(root)
+    layer_tree, layer_to_group = {}, {}
+    layer_tree_root = None
+
+    for event, element in events:
+        if ET.QName(element).localname == "layer-tree-group":
+            # The first group opened is the root of the layer tree; extract it once it is complete
+            if event == "start":
+                if layer_tree_root is None:
+                    layer_tree_root = element
+            elif element is layer_tree_root:
+                layer_tree, layer_to_group = extract_layer_tree_structure(layer_tree_root)
+            continue
+        if event != "end":
+            continue
 
-    for map_layer_node in root.findall(".//maplayer"):
-        layer_name = map_layer_node.findtext("layername", default="N/A")
-        layer_id = map_layer_node.findtext("id", default="N/A") # QGIS 3.x stores ID in id element
+        map_layer_node = element
+        layer_name = map_layer_node.findtext("{*}layername", default="N/A")
+        layer_id = map_layer_node.findtext("{*}id", default="N/A") # QGIS 3.x stores ID in id element
         if layer_id == "N/A": # Fallback for older QGIS versions or different structures
              layer_id = map_layer_node.get("id", default="N/A")
 
-        datasource = map_layer_node.findtext("datasource", default="N/A")
+        datasource = map_layer_node.findtext("{*}datasource", default="N/A")
         # Sanitize the datasource to remove passwords
         sanitized_datasource = sanitize_datasource(datasource)
         
@@ -165,7 +230,7 @@ def extract_layer_documentation_data(root):
         
         # If not found directly on the maplayer tag, look for a scalebasedvisibility element
         if min_scale == "0" and max_scale == "0":
-            scale_visibility_node = map_layer_node.find("scalebasedvisibility")
+            scale_visibility_node = map_layer_node.find("{*}scalebasedvisibility")
             if scale_visibility_node is not None and scale_visibility_node.get("enabled") == "1":
                 min_scale = scale_visibility_node.get("minimumScale", 
                            scale_visibility_node.get("minimumscale", "0"))
@@ -182,33 +247,67 @@ def extract_layer_documentation_data(root):
                 min_scale_text = f"Error parsing: {min_scale}"
                 max_scale_text = f"Error parsing: {max_scale}"
             
-        # Find group membership for this layer
-        group_path = layer_to_group.get(layer_id, "")
-
         layers_data.append({
             "name": layer_name,
             "id": layer_id,
             "datasource": sanitized_datasource,  # Use sanitized version
             "min_scale": min_scale_text,
             "max_scale": max_scale_text,
-            "group_path": group_path
+            "group_path": ""
         })
+
+        # Discard the processed layer and any layers before it to keep memory flat
+        map_layer_node.clear(keep_tail=True)
+        while map_layer_node.getprevious() is not None:
+            del map_layer_node.getparent()[0]
+    
+    # Find group membership for each layer now that the whole layer tree has been seen
+    for layer in layers_data:
+        layer["group_path"] = layer_to_group.get(layer["id"], "")
     
     return layers_data, layer_tree
 
+def classify_provider(datasource):
+    """
+    Returns the data provider key for a datasource string, used for the provider statistics.
+    An explicit provider= value wins, then PostgreSQL connection details, then OGR files.
+    """
+    # partition finds provider= in one scan, and only the first token after it is split off
+    _, found, rest = datasource.partition('provider=')
+    if found:
+        token = rest.split(None, 1)
+        if token:
+            return token[0].strip("'\"")
+    if 'postgres://' in datasource or 'host=' in datasource:
+        return 'postgres'
+    if datasource.endswith('.shp') or 'ogr:' in datasource:
+        return 'ogr'
+    return 'other'
+
+def escape_table_cell(text):
+    """
+    Escapes pipe characters so text can be placed in a Markdown table cell.
+    Empty values are shown as "N/A"; text without pipes is returned as is.
+    """
+    if not text:
+        return 'N/A'
+    if '|' not in text:
+        return text
+    return text.replace('|', '\\|')
+
 def get_current_date():
     """
     Returns the current date in a readable format for documentation.
     """
-    from datetime import datetime
     return datetime.now().strftime("%B %d, %Y")
 
-def format_as_markdown(project_file_name, layers_data, layer_tree, legend_config=None):
+def write_markdown(fp, project_file_name, layers_data, layer_tree, legend_config=None):
     """
-    Formats the extracted layer data as GitHub Wiki compatible Markdown.
+    Writes the extracted layer data as GitHub Wiki compatible Markdown to a text file handle.
     Optimized for GitHub Wiki with proper navigation and formatting.
     
     Args:
+        fp: Writable text file handle
         project_file_name (str): Name of the project file
         layers_data (list): List of layer data dictionaries
         layer_tree (dict): Layer tree structure
@@ -216,101 +315,105 @@ def format_as_markdown(project_file_name, layers_data, layer_tree, legend_config
     """
     if legend_config is None:
         legend_config = {"enabled": True, "base_url": None, "map_file": None}
+    generated_on = get_current_date()
+    write = fp.write
     if not layers_data:
-        return f"# {project_file_name} - Layer Documentation\n\n❌ **No layer data found** - Project could not be parsed or contains no layers.\n\n---\n*Generated on {get_current_date()}*\n"
+        write(f"# {project_file_name} - Layer Documentation\n\n❌ **No layer data found** - Project could not be parsed or contains no layers.\n\n---\n*Generated on {generated_on}*\n")
+        return
 
     # Extract project name without extension for cleaner titles
     project_name = os.path.splitext(project_file_name)[0]
     
-    md_string = f"# {project_name} - Layer Documentation\n\n"
+    write(f"# {project_name} - Layer Documentation\n\n")
     
     # Add project summary badge-style info
-    md_string += f"📊 **Project Summary**: {len(layers_data)} layers • {len(layer_tree)} groups • Generated on {get_current_date()}\n\n"
+    write(f"📊 **Project Summary**: {len(layers_data)} layers • {len(layer_tree)} groups • Generated on {generated_on}\n\n")
     
     # Add navigation links for GitHub Wiki
-    md_string += "## 🧭 Quick Navigation\n\n"
-    md_string += "| Section | Description |\n"
-    md_string += "|---------|-------------|\n"
-    md_string += "| [📖 Scale Guide](#-scale-interpretation-guide) | Understanding layer visibility settings |\n"
-    md_string += "| [🗂️ Layer Groups](#%EF%B8%8F-layer-groups-overview) | Project structure overview |\n"
+    write("## 🧭 Quick Navigation\n\n")
+    write("| Section | Description |\n")
+    write("|---------|-------------|\n")
+    write("| [📖 Scale Guide](#-scale-interpretation-guide) | Understanding layer visibility settings |\n")
+    write("| [🗂️ Layer Groups](#%EF%B8%8F-layer-groups-overview) | Project structure overview |\n")
     
     if legend_config["enabled"]:
-        md_string += "| [📋 Layer Details](#-detailed-layer-information) | Complete layer information with legends |\n"
+        write("| [📋 Layer Details](#-detailed-layer-information) | Complete layer information with legends |\n")
     else:
-        md_string += "| [📋 Layer Details](#-detailed-layer-information) | Complete layer information |\n"
+        write("| [📋 Layer Details](#-detailed-layer-information) | Complete layer information |\n")
     
-    md_string += "| [📈 Statistics](#-project-statistics) | Summary and provider breakdown |\n\n"
+    write("| [📈 Statistics](#-project-statistics) | Summary and provider breakdown |\n\n")
     
     # Add scale interpretation notes
-    md_string += "## 📖 Scale Interpretation Guide\n\n"
-    md_string += "> 💡 **Understanding Scale Values**: How QGIS determines when layers are visible based on map zoom level.\n\n"
-    md_string += "| Scale Type | Description | Example |\n"
-    md_string += "|------------|-------------|----------|\n"
-    md_string += "| **Min Scale (Zoomed Out)** | Layer visible when map scale ≥ this value | `1:50000` = visible at 1:50000, 1:100000, etc. |\n"
-    md_string += "| **Max Scale (Zoomed In)** | Layer visible when map scale < this value | `1:1000` = visible at 1:500, 1:250, etc. |\n"
-    md_string += "| **Always Visible** | No scale-based visibility configured | Layer shows at all zoom levels |\n"
-    md_string += "| **No Min/Max** | One limit not set | `No Min` = visible zoomed out, `No Max` = visible zoomed in |\n\n"
+    write("## 📖 Scale Interpretation Guide\n\n")
+    write("> 💡 **Understanding Scale Values**: How QGIS determines when layers are visible based on map zoom level.\n\n")
+    write("| Scale Type | Description | Example |\n")
+    write("|------------|-------------|----------|\n")
+    write("| **Min Scale (Zoomed Out)** | Layer visible when map scale ≥ this value | `1:50000` = visible at 1:50000, 1:100000, etc. |\n")
+    write("| **Max Scale (Zoomed In)** | Layer visible when map scale < this value | `1:1000` = visible at 1:500, 1:250, etc. |\n")
+    write("| **Always Visible** | No scale-based visibility configured | Layer shows at all zoom levels |\n")
+    write("| **No Min/Max** | One limit not set | `No Min` = visible zoomed out, `No Max` = visible zoomed in |\n\n")
     
     # Add layer groups overview
-    md_string += "## 🗂️ Layer Groups Overview\n\n"
-    md_string += "> **Project Structure**: Hierarchical organization of layers within the QGIS project.\n\n"
+    write("## 🗂️ Layer Groups Overview\n\n")
+    write("> **Project Structure**: Hierarchical organization of layers within the QGIS project.\n\n")
 
-    # Helper function to recursively generate the group structure in the markdown
-    def format_group_structure(group_path, indent=0):
-        nonlocal md_string
+    # Walk the group tree once, depth-first with an explicit stack of (group path, indent)
+    # starting from the root groups; both the overview and the detail tables use this order
+    ordered_groups = []
+    stack = [(path, 0) for path in reversed([path for path in layer_tree if "/" not in path])]
+    while stack:
+        group_path, indent = stack.pop()
         if group_path not in layer_tree:
-            return
+            continue
+        ordered_groups.append((group_path, indent))
         
-        group_info = layer_tree[group_path]
-        group_name = group_info["name"]
-
-        # Add group to markdown with proper indentation
-        md_string += f"{'  ' * indent}- **{group_name}** ({len(group_info['layers'])} layers)\n"
-        
-        # Recursively process child groups
-        for child_group_path in group_info["groups"]:
-            format_group_structure(child_group_path, indent+1)
+        # Queue child groups, reversed so they are visited in order
+        for child_group_path in reversed(layer_tree[group_path]["groups"]):
+            stack.append((child_group_path, indent + 1))
     
-    # Start with the root groups
-    root_groups = [path for path in layer_tree.keys() if "/" not in path]
-    for group_path in root_groups:
-        format_group_structure(group_path)
+    # Generate the group structure in the markdown with proper indentation
+    for group_path, indent in ordered_groups:
+        group_info = layer_tree[group_path]
+        write(f"{'  ' * indent}- **{group_info['name']}** ({len(group_info['layers'])} layers)\n")
     
     # Add ungrouped layers count if any
     ungrouped_layers = [layer for layer in layers_data if not layer.get("group_path")]
     if ungrouped_layers:
-        md_string += f"\n- 📄 **Ungrouped Layers** ({len(ungrouped_layers)} layers)\n"
+        write(f"\n- 📄 **Ungrouped Layers** ({len(ungrouped_layers)} layers)\n")
     
     # Add detailed layer information by group
-    md_string += "\n## 📋 Detailed Layer Information\n\n"
+    write("\n## 📋 Detailed Layer Information\n\n")
     if legend_config["enabled"]:
-        md_string += "> 🔍 **Layer Details**: Complete information for each layer including data sources, visibility settings, and interactive legends.\n\n"
+        write("> 🔍 **Layer Details**: Complete information for each layer including data sources, visibility settings, and interactive legends.\n\n")
     else:
-        md_string += "> 🔍 **Layer Details**: Complete information for each layer including data sources and visibility settings.\n\n"
+        write("> 🔍 **Layer Details**: Complete information for each layer including data sources and visibility settings.\n\n")
+    
+    # The legend URL of every layer shares the same prefix
+    legend_prefix = build_legend_prefix(legend_config["base_url"], legend_config["map_file"])
     
     # Helper function to create a table for layers in a specific group
     def create_group_table(group_path, group_layers):
-        nonlocal md_string
         group_name = layer_tree[group_path]["name"] if group_path in layer_tree else "Ungrouped Layers"
         
         # Use GitHub-style collapsible sections
-        md_string += f"<details>\n<summary>📂 <strong>{group_name}</strong> ({len(group_layers)} layers)</summary>\n\n"
+        write(f"<details>\n<summary>📂 <strong>{group_name}</strong> ({len(group_layers)} layers)</summary>\n\n")
         
         # Table headers - include legend column if enabled
         if legend_config["enabled"]:
-            md_string += "| Layer Name | Datasource | Min Scale | Max Scale | Legend |\n"
-            md_string += "|------------|------------|-----------|----------|--------|\n"
+            write("| Layer Name | Datasource | Min Scale | Max Scale | Legend |\n")
+            write("|------------|------------|-----------|----------|--------|\n")
         else:
-            md_string += "| Layer Name | Datasource | Min Scale | Max Scale |\n"
-            md_string += "|------------|------------|-----------|----------|\n"
+            write("| Layer Name | Datasource | Min Scale | Max Scale |\n")
+            write("|------------|------------|-----------|----------|\n")
+        
+        # Truncate very long datasources for better GitHub Wiki display
+        datasource_limit = 100 if legend_config["enabled"] else 120
         
         for layer in group_layers:
             # Escape pipe characters for Markdown table
-            datasource_md = layer['datasource'].replace('|', '\\|') if layer['datasource'] else 'N/A'
-            layer_name_md = layer['name'].replace('|', '\\|') if layer['name'] else 'N/A'
+            datasource_md = escape_table_cell(layer['datasource'])
+            layer_name_md = escape_table_cell(layer['name'])
             
-            # Truncate very long datasources for better GitHub Wiki display
-            datasource_limit = 100 if legend_config["enabled"] else 120
             if len(datasource_md) > datasource_limit:
                 datasource_md = datasource_md[:datasource_limit-3] + "..."
             
@@ -319,96 +422,55 @@ def format_as_markdown(project_file_name, layers_data, layer_tree, legend_config
             
             # Add legend column if enabled
             if legend_config["enabled"]:
-                legend_url = getLegend(layer['name'], legend_config["base_url"], legend_config["map_file"])
+                legend_url = legend_prefix + quote_layer_name(layer['name'])
                 # legend_image = f"![{layer['name']} Legend]({legend_url})"
                 # row += f" | {legend_image}"
                 # Use a clickable link instead of embedded image
                 row += f" | [🎨 Legend]({legend_url})"            
             row += " |\n"
-            md_string += row
+            write(row)
         
-        md_string += "\n</details>\n\n"
+        write("\n</details>\n\n")
     
     # Create a dictionary to group layers by their group path, maintaining order
-    layers_by_group = {}
+    layers_by_group = defaultdict(list)
     for layer in layers_data:
-        group_path = layer.get('group_path', '')
-        if group_path not in layers_by_group:
-            layers_by_group[group_path] = []
-        layers_by_group[group_path].append(layer)
+        layers_by_group[layer.get('group_path', '')].append(layer)
     
-    # Sort layers within each group based on their order in the layer tree
-    def sort_layers_by_tree_order(group_path, group_layers):
+    # Sort layers within each group in place based on their order in the layer tree,
+    # mapping layer IDs to tree positions once per group
+    for group_path, group_layers in layers_by_group.items():
         if group_path in layer_tree:
-            # Create a mapping of layer IDs to their order in the tree
-            tree_layers = layer_tree[group_path]["layers"]
-            layer_order = {layer_info["id"]: idx for idx, layer_info in enumerate(tree_layers)}
-            
-            # Sort group_layers based on their position in the tree
-            return sorted(group_layers, key=lambda layer: layer_order.get(layer["id"], 999))
-        return group_layers
-    
-    # Apply sorting to all groups
-    for group_path in layers_by_group:
-        layers_by_group[group_path] = sort_layers_by_tree_order(group_path, layers_by_group[group_path])
+            layer_order = {layer_info["id"]: idx for idx, layer_info in enumerate(layer_tree[group_path]["layers"])}
+            group_layers.sort(key=lambda layer, order=layer_order: order.get(layer["id"], 999))
     
     # Process groups in the order they appear in the layer tree
-    def process_groups_in_order(parent_path=""):
-        # Get groups at this level
-        if parent_path == "":
-            # Root level groups
-            current_groups = [path for path in layer_tree.keys() if "/" not in path]
-        else:
-            # Child groups of the current parent
-            if parent_path in layer_tree:
-                current_groups = layer_tree[parent_path]["groups"]
-            else:
-                return
-        
-        # Process each group at this level
-        for group_path in current_groups:
-            if group_path in layers_by_group:
-                create_group_table(group_path, layers_by_group[group_path])
-            
-            # Recursively process child groups
-            process_groups_in_order(group_path)
-    
-    # Start processing from root level
-    process_groups_in_order()
+    for group_path, _ in ordered_groups:
+        if group_path in layers_by_group:
+            create_group_table(group_path, layers_by_group[group_path])
     
     # Handle ungrouped layers
     if ungrouped_layers:
         create_group_table("", ungrouped_layers)
     
     # Add summary statistics
-    md_string += "## 📈 Project Statistics\n\n"
-    md_string += "> 📊 **Overview**: Summary of layers, groups, and data providers in this QGIS project.\n\n"
+    write("## 📈 Project Statistics\n\n")
+    write("> 📊 **Overview**: Summary of layers, groups, and data providers in this QGIS project.\n\n")
     
     # Create statistics in a nice GitHub-style info box
-    md_string += "### 📋 Summary\n\n"
-    md_string += "| Metric | Count |\n"
-    md_string += "|--------|-------|\n"
-    md_string += f"| 🗂️ **Total Layers** | {len(layers_data)} |\n"
-    md_string += f"| 📁 **Layer Groups** | {len(layer_tree)} |\n"
-    md_string += f"| 📄 **Ungrouped Layers** | {len(ungrouped_layers)} |\n\n"
+    write("### 📋 Summary\n\n")
+    write("| Metric | Count |\n")
+    write("|--------|-------|\n")
+    write(f"| 🗂️ **Total Layers** | {len(layers_data)} |\n")
+    write(f"| 📁 **Layer Groups** | {len(layer_tree)} |\n")
+    write(f"| 📄 **Ungrouped Layers** | {len(ungrouped_layers)} |\n\n")
     
     # Provider statistics
-    provider_counts = {}
-    for layer in layers_data:
-        datasource = layer.get('datasource', '')
-        if 'provider=' in datasource:
-            provider = datasource.split('provider=')[1].split()[0].strip("'\"")
-            provider_counts[provider] = provider_counts.get(provider, 0) + 1
-        elif 'postgres://' in datasource or 'host=' in datasource:
-            provider_counts['postgres'] = provider_counts.get('postgres', 0) + 1
-        elif datasource.endswith('.shp') or 'ogr:' in datasource:
-            provider_counts['ogr'] = provider_counts.get('ogr', 0) + 1
-        else:
-            provider_counts['other'] = provider_counts.get('other', 0) + 1
+    provider_counts = Counter(classify_provider(layer.get('datasource', '')) for layer in layers_data)
     
-    md_string += "### 🔌 Data Providers\n\n"
-    md_string += "| Provider | Layer Count | Description |\n"
-    md_string += "|----------|-------------|-------------|\n"
+    write("### 🔌 Data Providers\n\n")
+    write("| Provider | Layer Count | Description |\n")
+    write("|----------|-------------|-------------|\n")
     
     provider_descriptions = {
         'postgres': 'PostgreSQL database layers',
@@ -422,53 +484,54 @@ def format_as_markdown(project_file_name, layers_data, layer_tree, legend_config
     
     for provider, count in sorted(provider_counts.items()):
         description = provider_descriptions.get(provider, 'Custom or specialized provider')
-        md_string += f"| `{provider}` | {count} | {description} |\n"
+        write(f"| `{provider}` | {count} | {description} |\n")
     
     # Add footer with generation info
-    md_string += f"\n---\n\n🤖 *Generated automatically on {get_current_date()} using the QGIS Project Toolkit*\n\n"
-    md_string += "💡 **Need help?** Check the [project documentation](../README.md) for more information about these tools.\n"
-    
-    return md_string
+    write(f"\n---\n\n🤖 *Generated automatically on {generated_on} using the QGIS Project Toolkit*\n\n")
+    write("💡 **Need help?** Check the [project documentation](../README.md) for more information about these tools.\n")
+
+def format_as_markdown(project_file_name, layers_data, layer_tree, legend_config=None):
+    """
+    Formats the extracted layer data as a GitHub Wiki compatible Markdown string.
+    """
+    output = io.StringIO()
+    write_markdown(output, project_file_name, layers_data, layer_tree, legend_config)
+    return output.getvalue()
 
 def generate_wiki_sidebar(layers_data, layer_tree, project_name):
     """
     Generates a GitHub Wiki sidebar (_Sidebar.md) content for easy navigation.
     """
-    sidebar = f"## 📖 {project_name} Wiki\n\n"
-    sidebar += "### 🏠 Main Pages\n"
-    sidebar += "- [🏠 Home](Home)\n"
-    sidebar += f"- [📋 Layer Documentation]({project_name.replace(' ', '-')}-Layer-Documentation)\n\n"
+    sidebar_parts = [f"## 📖 {project_name} Wiki\n\n"]
+    sidebar_parts.append("### 🏠 Main Pages\n")
+    sidebar_parts.append("- [🏠 Home](Home)\n")
+    sidebar_parts.append(f"- [📋 Layer Documentation]({project_name.replace(' ', '-')}-Layer-Documentation)\n\n")
     
-    sidebar += "### 🗂️ Layer Groups\n"
+    sidebar_parts.append("### 🗂️ Layer Groups\n")
     root_groups = [path for path in layer_tree.keys() if "/" not in path]
     for group_path in root_groups[:10]:  # Limit to first 10 groups to avoid sidebar clutter
         group_name = layer_tree[group_path]["name"]
         safe_name = group_name.replace(' ', '-').replace('/', '-')
-        sidebar += f"- 📁 [{group_name}]({project_name.replace(' ', '-')}-Layer-Documentation#{safe_name.lower()})\n"
+        sidebar_parts.append(f"- 📁 [{group_name}]({project_name.replace(' ', '-')}-Layer-Documentation#{safe_name.lower()})\n")
     
     if len(root_groups) > 10:
-        sidebar += f"- ... and {len(root_groups) - 10} more groups\n"
+        sidebar_parts.append(f"- ... and {len(root_groups) - 10} more groups\n")
     
-    sidebar += f"\n### 📊 Quick Stats\n"
-    sidebar += f"- 🗂️ {len(layers_data)} layers\n"
-    sidebar += f"- 📁 {len(layer_tree)} groups\n"
+    sidebar_parts.append(f"\n### 📊 Quick Stats\n")
+    sidebar_parts.append(f"- 🗂️ {len(layers_data)} layers\n")
+    sidebar_parts.append(f"- 📁 {len(layer_tree)} groups\n")
     
-    return sidebar
+    return "".join(sidebar_parts)
 
-def format_as_csv(layers_data):
+def format_as_csv(layers_data, fp):
     """
-    Formats the extracted layer data as a CSV string.
+    Writes the extracted layer data as CSV to a text file handle opened with newline=''.
     """
     if not layers_data:
-        return ""
-
-    # Import csv module here to keep it local to this function if not used elsewhere
-    import csv
-    from io import StringIO
+        return
 
-    output = StringIO()
     # Use a more robust CSV writer that handles quoting
-    writer = csv.writer(output, quoting=csv.QUOTE_MINIMAL)
+    writer = csv.writer(fp, quoting=csv.QUOTE_MINIMAL)
 
     # CSV Header
     header = ["Layer Name", "Layer ID", "Group Path", "Datasource", "Min Scale", "Max Scale"]
@@ -488,10 +551,11 @@ def format_as_csv(layers_data):
             layer.get('max_scale', 'N/A')
         ]
         writer.writerow(row)
-    
-    return output.getvalue()
 
-def main():
+def build_parser():
+    """
+    Returns the command line argument parser for the documentation generator.
+    """
     parser = argparse.ArgumentParser(description="Generate GitHub Wiki documentation for layers in a QGIS project file, including group structure, datasource and zoom levels (scale visibility).")
     parser.add_argument("input_project", help="Path to the input QGIS project file (.qgs or .qgz)")
     parser.add_argument("-o", "--output", help="Path to the output Markdown file. If not specified, prints to console.")
@@ -501,47 +565,48 @@ def main():
     parser.add_argument("--legend-base-url", help="Base URL for WMS legend service (defaults to topo-qgis.atkv3-dev.kartverket-intern.cloud)")
     parser.add_argument("--legend-map-file", help="Path to map file on server for legend generation (defaults to /opt/qgis/Topo_2025.qgs)")
     parser.add_argument("--no-legends", action="store_true", help="Disable legend generation in documentation")
-    
-    args = parser.parse_args()
+    return parser
 
-    project_file_path = args.input_project
-    output_file_path = args.output
-    csv_output_path = args.csv
-    sidebar_path = args.sidebar
-    wiki_title = args.wiki_title
+def run(project_file_path, output_file_path=None, csv_output_path=None, sidebar_path=None,
+        legend_config=None, wiki_title=None):
+    """
+    Generates the documentation for one QGIS project without going through argparse,
+    so many projects can be documented from a single Python process.
     
-    # Configure legend settings
-    legend_config = {
-        "enabled": not args.no_legends,
-        "base_url": args.legend_base_url,
-        "map_file": args.legend_map_file
-    }
-
+    Args:
+        project_file_path (str): Path to the input QGIS project file (.qgs or .qgz)
+        output_file_path (str, optional): Path to the output Markdown file, printed to console if not set
+        csv_output_path (str, optional): Path to the output CSV file
+        sidebar_path (str, optional): Path to the GitHub Wiki sidebar file
+        legend_config (dict, optional): Configuration for legend generation
+        wiki_title (str, optional): Custom title for the wiki page
+        
+    Returns:
+        int: Exit code (0 for success, 1 if the project could not be read)
+    """
     if not os.path.exists(project_file_path):
         print(f"Error: Input project file '{project_file_path}' not found.", file=sys.stderr)
-        sys.exit(1)
+        return 1
 
-    xml_root = parse_qgis_project_xml(project_file_path)
+    project_data = parse_qgis_project_xml(project_file_path)
     
-    if xml_root is None:
-        sys.exit(1)
+    if project_data is None:
+        return 1
         
-    layers_data, layer_tree = extract_layer_documentation_data(xml_root)
+    layers_data, layer_tree = project_data
     project_file_name = os.path.basename(project_file_path)
     project_name = wiki_title or os.path.splitext(project_file_name)[0]
     
     # Generate Markdown output
-    markdown_output = format_as_markdown(project_file_name, layers_data, layer_tree, legend_config)
-    
     if output_file_path:
         try:
             with open(output_file_path, 'w', encoding='utf-8') as f:
-                f.write(markdown_output)
+                write_markdown(f, project_file_name, layers_data, layer_tree, legend_config)
             print(f"📋 Wiki documentation successfully written to {output_file_path}")
         except IOError as e:
             print(f"Error: Could not write to output file {output_file_path}. {e}", file=sys.stderr)
     else:
-        print(markdown_output)
+        print(format_as_markdown(project_file_name, layers_data, layer_tree, legend_config))
 
     # Generate sidebar if requested
     if sidebar_path:
@@ -554,16 +619,29 @@ def main():
             print(f"Error: Could not write to sidebar file {sidebar_path}. {e}", file=sys.stderr)
 
     if csv_output_path:
-        csv_output = format_as_csv(layers_data)
-        if csv_output:
+        if layers_data:
             try:
                 with open(csv_output_path, 'w', encoding='utf-8', newline='') as f:
-                    f.write(csv_output)
+                    format_as_csv(layers_data, f)
                 print(f"📊 CSV data successfully written to {csv_output_path}")
             except IOError as e:
                 print(f"Error: Could not write to CSV output file {csv_output_path}. {e}", file=sys.stderr)
         else:
             print("No data to write to CSV.")
+    
+    return 0
+
+def main():
+    args = build_parser().parse_args()
+    
+    # Configure legend settings
+    legend_config = {
+        "enabled": not args.no_legends,
+        "base_url": args.legend_base_url,
+        "map_file": args.legend_map_file
+    }
+    
+    sys.exit(run(args.input_project, args.output, args.csv, args.sidebar, legend_config, args.wiki_title))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
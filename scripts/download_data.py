@@ -13,8 +13,13 @@ The FlatGeobuf format provides efficient random access to features in the data.
 import os
 import sys
 import argparse
+import concurrent.futures
+import hashlib
+import json
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import zipfile
 import subprocess
 import tempfile
@@ -23,6 +28,14 @@ from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 from tqdm import tqdm
 
+# Convert in-process with the GDAL Python bindings when they are installed,
+# otherwise fall back to running the ogr2ogr command line tool
+try:
+    from osgeo import gdal
+    gdal.UseExceptions()
+except ImportError:
+    gdal = None
+
 
 # Configure logging
 logging.basicConfig(
@@ -52,40 +65,171 @@ DATASETS = {
     }
 }
 
+# Size of each piece read from the HTTP response and written to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Archives downloaded straight into memory spill over to a temporary file beyond this size
+ZIP_BUFFER_MAX_SIZE = 64 * 1024 * 1024
+
+# (connect, read) timeout in seconds for download requests
+DOWNLOAD_TIMEOUT = (5, 60)
+
+
+def create_session() -> requests.Session:
+    """
+    Create an HTTP session that keeps connections alive between downloads
+    and retries transient failures.
+    
+    Returns:
+        requests.Session: Session with a pooling, retrying HTTPS adapter mounted
+    """
+    session = requests.Session()
+    retries = Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries))
+    return session
+
+
+# Downloaded archives are kept here between runs and only fetched again when
+# the server reports they have changed
+DOWNLOAD_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "tnt-topo", "natural_earth"
+)
+
+
+# GDAL settings for reading a shapefile straight out of a remote zip, so only the
+# byte ranges ogr2ogr needs are fetched, in large cached requests
+VSICURL_CONFIG = {
+    "GDAL_HTTP_MULTIPLEX": "YES",
+    "CPL_VSIL_CURL_CHUNK_SIZE": "1048576",
+    "VSI_CACHE": "TRUE",
+    "VSI_CACHE_SIZE": "67108864"
+}
+
+
+# All datasets are served from the same host, so one session lets every
+# download reuse the same TCP/TLS connection
+SESSION = create_session()
+
+
+def load_validators(target_path: str) -> Dict[str, str]:
+    """
+    Load the ETag/Last-Modified headers saved with a previous download.
+    
+    Args:
+        target_path (str): Path of the downloaded file
+        
+    Returns:
+        Dict[str, str]: Saved validators, empty if the file or its validators are missing
+    """
+    validators_path = f"{target_path}.json"
+    if not (os.path.exists(target_path) and os.path.exists(validators_path)):
+        return {}
+    try:
+        with open(validators_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
 
-def download_file(url: str, target_path: str) -> bool:
+def save_validators(target_path: str, headers) -> None:
+    """
+    Save the ETag/Last-Modified headers of a download next to the downloaded file.
+    
+    Args:
+        target_path (str): Path of the downloaded file
+        headers: Response headers of the download
+    """
+    validators = {key: headers[key] for key in ("ETag", "Last-Modified") if key in headers}
+    validators_path = f"{target_path}.json"
+    if validators:
+        with open(validators_path, 'w', encoding='utf-8') as f:
+            json.dump(validators, f)
+    elif os.path.exists(validators_path):
+        os.remove(validators_path)
+
+
+class ProgressWriter:
+    """
+    Binary file wrapper that advances a progress bar by the size of every write.
+    """
+    
+    def __init__(self, f, progress_bar: tqdm):
+        self.f = f
+        self.progress_bar = progress_bar
+    
+    def write(self, data: bytes) -> int:
+        written = self.f.write(data)
+        self.progress_bar.update(len(data))
+        return written
+
+
+def write_response(response: requests.Response, f, desc: str, position: int = 0) -> None:
+    """
+    Stream the body of an HTTP response into a binary file object with a progress bar.
+    
+    Args:
+        response (requests.Response): Streamed response to read from
+        f: Binary file object to write to
+        desc (str): Description shown on the progress bar
+        position (int): Line of the progress bar, so parallel downloads stack
+    """
+    total_size = int(response.headers.get('content-length', 0))
+    
+    with tqdm(
+        desc=desc,
+        total=total_size,
+        unit='B',
+        unit_scale=True,
+        unit_divisor=1024,
+        position=position,
+    ) as progress_bar:
+        # Copy the raw stream in DOWNLOAD_CHUNK_SIZE reads, still decoding any
+        # gzip/deflate content encoding as iter_content would
+        response.raw.decode_content = True
+        shutil.copyfileobj(response.raw, ProgressWriter(f, progress_bar), length=DOWNLOAD_CHUNK_SIZE)
+
+
+def download_file(url: str, target_path: str, position: int = 0) -> bool:
     """
     Download a file from a URL to a target path.
     
+    If the file was downloaded before, the request is made conditional on its saved
+    ETag/Last-Modified headers and the existing file is kept when the server
+    answers 304 Not Modified.
+    
     Args:
         url (str): URL to download from
         target_path (str): Path to save the downloaded file
+        position (int): Line of the progress bar, so parallel downloads stack
         
     Returns:
         bool: True if download was successful, False otherwise
     """
     try:
-        # Create target directory if it doesn't exist
-        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        # Only fetch the file again if it changed since the previous download
+        validators = load_validators(target_path)
+        headers = {}
+        if "ETag" in validators:
+            headers["If-None-Match"] = validators["ETag"]
+        if "Last-Modified" in validators:
+            headers["If-Modified-Since"] = validators["Last-Modified"]
         
         # Stream the download with progress bar
-        response = requests.get(url, stream=True)
+        response = SESSION.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT, headers=headers)
+        if response.status_code == 304:
+            response.close()
+            logger.info(f"{target_path} is up to date with {url}, skipping download")
+            return True
         response.raise_for_status()
         
-        total_size = int(response.headers.get('content-length', 0))
-        
-        with open(target_path, 'wb') as f, tqdm(
-            desc=f"Downloading {os.path.basename(target_path)}",
-            total=total_size,
-            unit='B',
-            unit_scale=True,
-            unit_divisor=1024,
-        ) as progress_bar:
-            for chunk in response.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
-                    progress_bar.update(len(chunk))
+        # Write to a partial file first so an interrupted download is never mistaken for a complete one
+        partial_path = f"{target_path}.part"
+        with open(partial_path, 'wb') as f:
+            write_response(response, f, f"Downloading {os.path.basename(target_path)}", position)
         
+        os.replace(partial_path, target_path)
+        save_validators(target_path, response.headers)
         logger.info(f"Downloaded {url} to {target_path}")
         return True
     
@@ -106,25 +250,10 @@ def extract_zip(zip_path: str, extract_dir: str) -> bool:
         bool: True if extraction was successful, False otherwise
     """
     try:
-        os.makedirs(extract_dir, exist_ok=True)
-        
+        # The archives hold a handful of files and extract in well under a second,
+        # so they are extracted in one call without a progress bar
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            # Get total size for progress bar
-            total_size = sum(file.file_size for file in zip_ref.infolist())
-            extracted_size = 0
-            
-            # Create progress bar
-            with tqdm(
-                desc=f"Extracting {os.path.basename(zip_path)}",
-                total=total_size,
-                unit='B',
-                unit_scale=True,
-                unit_divisor=1024,
-            ) as progress_bar:
-                for file in zip_ref.infolist():
-                    zip_ref.extract(file, extract_dir)
-                    extracted_size += file.file_size
-                    progress_bar.update(file.file_size)
+            zip_ref.extractall(extract_dir)
         
         logger.info(f"Extracted {zip_path} to {extract_dir}")
         return True
@@ -134,6 +263,38 @@ def extract_zip(zip_path: str, extract_dir: str) -> bool:
         return False
 
 
+def download_and_extract(url: str, extract_dir: str, position: int = 0) -> bool:
+    """
+    Download a ZIP file into memory and extract it to a directory, without
+    writing the archive itself to disk.
+    
+    Args:
+        url (str): URL of the ZIP file
+        extract_dir (str): Directory to extract to
+        position (int): Line of the progress bar, so parallel downloads stack
+        
+    Returns:
+        bool: True if download and extraction were successful, False otherwise
+    """
+    try:
+        response = SESSION.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        
+        # Large archives spill over to a temporary file instead of growing memory without bound
+        with tempfile.SpooledTemporaryFile(max_size=ZIP_BUFFER_MAX_SIZE) as buffer:
+            write_response(response, buffer, f"Downloading {url.rsplit('/', 1)[-1]}", position)
+            buffer.seek(0)
+            with zipfile.ZipFile(buffer, 'r') as zip_ref:
+                zip_ref.extractall(extract_dir)
+        
+        logger.info(f"Downloaded and extracted {url} to {extract_dir}")
+        return True
+    
+    except Exception as e:
+        logger.error(f"Error downloading and extracting {url}: {str(e)}")
+        return False
+
+
 def check_ogr2ogr_available() -> bool:
     """
     Check if ogr2ogr is available in the system.
@@ -159,13 +320,19 @@ def check_ogr2ogr_available() -> bool:
         return False
 
 
-def convert_to_flatgeobuf(shapefile_path: str, fgb_path: str) -> bool:
+def convert_to_flatgeobuf(
+    shapefile_path: str,
+    fgb_path: str,
+    config_options: Optional[Dict[str, str]] = None
+) -> bool:
     """
-    Convert a Shapefile to FlatGeobuf format using ogr2ogr.
+    Convert a Shapefile to FlatGeobuf format, in-process with the GDAL Python
+    bindings when they are installed and with ogr2ogr otherwise.
     
     Args:
-        shapefile_path (str): Path to the Shapefile
+        shapefile_path (str): Path to the Shapefile, or a GDAL virtual file system path to it
         fgb_path (str): Path to save the FlatGeobuf file
+        config_options (Optional[Dict[str, str]]): GDAL configuration options for the conversion
         
     Returns:
         bool: True if conversion was successful, False otherwise
@@ -173,10 +340,11 @@ def convert_to_flatgeobuf(shapefile_path: str, fgb_path: str) -> bool:
     try:
         logger.info(f"Converting {os.path.basename(shapefile_path)} to FlatGeobuf")
         
-        # Create directory for output file if it doesn't exist
-        os.makedirs(os.path.dirname(fgb_path), exist_ok=True)
+        if gdal is not None:
+            return translate_to_flatgeobuf(shapefile_path, fgb_path, config_options or {})
         
-        # Run ogr2ogr to convert from Shapefile to FlatGeobuf
+        # Run ogr2ogr to convert from Shapefile to FlatGeobuf, passing the
+        # configuration options through its environment
         result = subprocess.run(
             [
                 "ogr2ogr", 
@@ -187,7 +355,8 @@ def convert_to_flatgeobuf(shapefile_path: str, fgb_path: str) -> bool:
             ],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True
+            text=True,
+            env={**os.environ, **config_options} if config_options else None
         )
         
         if result.returncode == 0:
@@ -202,12 +371,66 @@ def convert_to_flatgeobuf(shapefile_path: str, fgb_path: str) -> bool:
         return False
 
 
+def translate_to_flatgeobuf(shapefile_path: str, fgb_path: str, config_options: Dict[str, str]) -> bool:
+    """
+    Convert a Shapefile to FlatGeobuf format with gdal.VectorTranslate, the
+    in-process equivalent of the ogr2ogr command.
+    
+    Args:
+        shapefile_path (str): Path to the Shapefile, or a GDAL virtual file system path to it
+        fgb_path (str): Path to save the FlatGeobuf file
+        config_options (Dict[str, str]): GDAL configuration options for the conversion
+        
+    Returns:
+        bool: True if conversion was successful, False otherwise
+        
+    Raises:
+        RuntimeError: If GDAL reports an error during the conversion
+    """
+    # Thread-local, so datasets converted in parallel do not see each other's options
+    for key, value in config_options.items():
+        gdal.SetThreadLocalConfigOption(key, value)
+    try:
+        options = gdal.VectorTranslateOptions(format="FlatGeobuf", geometryType="PROMOTE_TO_MULTI")
+        dataset = gdal.VectorTranslate(fgb_path, shapefile_path, options=options)
+        if dataset is None:
+            logger.error(f"Error converting {shapefile_path} to FlatGeobuf")
+            return False
+        # Dropping the last reference closes the dataset and flushes it to disk
+        dataset = None
+    finally:
+        for key in config_options:
+            gdal.SetThreadLocalConfigOption(key, None)
+    
+    logger.info(f"Converted {shapefile_path} to {fgb_path}")
+    return True
+
+
+def convert_remote_to_flatgeobuf(url: str, shapefile: str, fgb_path: str) -> bool:
+    """
+    Convert a Shapefile inside a remote ZIP file to FlatGeobuf without downloading
+    or extracting the archive, using GDAL's /vsizip/ and /vsicurl/ virtual file systems.
+    
+    Args:
+        url (str): URL of the ZIP file
+        shapefile (str): Name of the Shapefile inside the ZIP file
+        fgb_path (str): Path to save the FlatGeobuf file
+        
+    Returns:
+        bool: True if conversion was successful, False otherwise
+    """
+    remote_path = f"/vsizip//vsicurl/{url}/{shapefile}"
+    return convert_to_flatgeobuf(remote_path, fgb_path, config_options=VSICURL_CONFIG)
+
+
 def process_dataset(
     dataset_name: str, 
     dataset_config: Dict, 
     data_dir: str,
-    temp_dir: str,
-    force: bool = False
+    work_dir: str,
+    force: bool = False,
+    position: int = 0,
+    keep_archive: bool = True
 ) -> bool:
     """
     Process a dataset: download, extract, and convert to FlatGeobuf.
@@ -216,17 +439,23 @@ def process_dataset(
         dataset_name (str): Name of the dataset
         dataset_config (Dict): Configuration for the dataset
         data_dir (str): Directory to save the final FlatGeobuf files
-        temp_dir (str): Temporary directory for downloads and extraction
+        work_dir (str): Directory for downloads and extraction, either the download
+            cache or a temporary directory
         force (bool): Force processing even if the output file exists
+        position (int): Line used for this dataset's progress bars
+        keep_archive (bool): Save the downloaded ZIP file in work_dir; otherwise it is
+            only held in memory while it is extracted
         
     Returns:
         bool: True if processing was successful, False otherwise
     """
     logger.info(f"Processing dataset: {dataset_name} - {dataset_config['description']}")
     
-    # Define paths
-    zip_path = os.path.join(temp_dir, f"{dataset_name}.zip")
-    extract_path = os.path.join(temp_dir, dataset_name)
+    # Define paths, keyed on the URL so a changed source never reuses a stale download
+    url_hash = hashlib.sha256(dataset_config["url"].encode()).hexdigest()[:16]
+    zip_path = os.path.join(work_dir, f"{dataset_name}-{url_hash}.zip")
+    extract_path = os.path.join(work_dir, f"{dataset_name}-{url_hash}")
+    extracted_marker = os.path.join(extract_path, ".extracted")
     shapefile_path = os.path.join(extract_path, dataset_config["shapefile"])
     fgb_path = os.path.join(data_dir, f"{dataset_name}.fgb")
     
@@ -235,9 +464,38 @@ def process_dataset(
         logger.info(f"FlatGeobuf file {fgb_path} already exists, skipping (use --force to override)")
         return True
     
-    # Download, extract, and convert
-    if download_file(dataset_config["url"], zip_path):
-        if extract_zip(zip_path, extract_path):
+    # A cached archive is revalidated with a conditional request and converted locally,
+    # so an unchanged dataset is not downloaded again. Without one, read the shapefile
+    # straight out of the remote zip when GDAL can
+    cached = keep_archive and bool(load_validators(zip_path))
+    if not cached:
+        if convert_remote_to_flatgeobuf(dataset_config["url"], dataset_config["shapefile"], fgb_path):
+            return True
+        
+        # Otherwise fall back to a local copy, discarding any partial output first
+        logger.warning(f"Could not stream {dataset_name} from {dataset_config['url']}, downloading it instead")
+        if os.path.exists(fgb_path):
+            os.remove(fgb_path)
+    
+    # Create the working directories once for the local copy; data_dir has already been created by main()
+    os.makedirs(extract_path, exist_ok=True)
+    
+    # Extract straight from memory when the archive does not need to be kept
+    if not keep_archive:
+        if download_and_extract(dataset_config["url"], extract_path, position):
+            if convert_to_flatgeobuf(shapefile_path, fgb_path):
+                return True
+        return False
+    
+    # Download, extract, and convert; an archive that was not downloaded again
+    # is older than its marker and does not need to be extracted again
+    if download_file(dataset_config["url"], zip_path, position):
+        extracted = (os.path.exists(extracted_marker)
+                     and os.path.getmtime(extracted_marker) >= os.path.getmtime(zip_path))
+        if not extracted and extract_zip(zip_path, extract_path):
+            Path(extracted_marker).touch()
+            extracted = True
+        if extracted:
             if convert_to_flatgeobuf(shapefile_path, fgb_path):
                 return True
     
@@ -276,10 +534,21 @@ def main() -> int:
         action="store_true",
         help="Force processing even if output files exist"
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        help="Number of datasets to process in parallel (default: up to 4)"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"Download into a temporary directory instead of reusing archives cached in {DOWNLOAD_CACHE_DIR}"
+    )
     parser.add_argument(
         "--keep-temp", 
         action="store_true",
-        help="Keep temporary files after processing"
+        help="With --no-cache, keep the downloaded archives and extracted files in the temporary directory"
     )
     
     args = parser.parse_args()
@@ -288,33 +557,50 @@ def main() -> int:
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
     
-    # Check if ogr2ogr is available
-    if not check_ogr2ogr_available():
-        logger.error("ogr2ogr is required for conversion to FlatGeobuf format.")
+    # Check if ogr2ogr is needed and available
+    if gdal is not None:
+        logger.info(f"Using GDAL Python bindings {gdal.__version__}")
+    elif not check_ogr2ogr_available():
+        logger.error("ogr2ogr or the GDAL Python bindings are required for conversion to FlatGeobuf format.")
         logger.error("Please install GDAL/OGR tools before running this script.")
         return 1
     
-    # Create temporary directory
-    temp_dir = tempfile.mkdtemp(prefix="tnt-topo-")
-    logger.debug(f"Created temporary directory: {temp_dir}")
+    # Create a temporary directory for the downloads when they are not cached
+    temp_dir = None
+    if args.no_cache:
+        temp_dir = tempfile.mkdtemp(prefix="tnt-topo-")
+        logger.debug(f"Created temporary directory: {temp_dir}")
     
     try:
         # Create output directory
         os.makedirs(args.data_dir, exist_ok=True)
         
+        # Reuse archives from earlier runs unless caching is disabled
+        work_dir = temp_dir if args.no_cache else DOWNLOAD_CACHE_DIR
+        # Archives only need to reach the disk if they are cached or kept for inspection
+        keep_archive = not args.no_cache or args.keep_temp
+        
         # Determine datasets to process
         if "all" in args.datasets:
             selected_datasets = DATASETS
         else:
             selected_datasets = {name: DATASETS[name] for name in args.datasets}
         
-        # Process each dataset
+        # Process the datasets in parallel so one dataset's download overlaps
+        # another's extraction and conversion; each gets its own progress bar line
         success_count = 0
         total_datasets = len(selected_datasets)
+        max_workers = args.jobs or min(4, total_datasets)
         
-        for dataset_name, dataset_config in selected_datasets.items():
-            if process_dataset(dataset_name, dataset_config, args.data_dir, temp_dir, args.force):
-                success_count += 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(process_dataset, dataset_name, dataset_config,
+                                args.data_dir, work_dir, args.force, position, keep_archive)
+                for position, (dataset_name, dataset_config) in enumerate(selected_datasets.items())
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                if future.result():
+                    success_count += 1
         
         # Report results
         logger.info(f"Successfully processed {success_count} of {total_datasets} datasets")
@@ -324,12 +610,15 @@ def main() -> int:
         return 0 if success_count == total_datasets else 1
     
     finally:
+        SESSION.close()
+        
         # Clean up temporary directory
-        if not args.keep_temp:
-            logger.debug(f"Removing temporary directory: {temp_dir}")
-            shutil.rmtree(temp_dir, ignore_errors=True)
-        else:
-            logger.info(f"Temporary files kept at: {temp_dir}")
+        if temp_dir is not None:
+            if not args.keep_temp:
+                logger.debug(f"Removing temporary directory: {temp_dir}")
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            else:
+                logger.info(f"Temporary files kept at: {temp_dir}")
 
 
 if __name__ == "__main__":
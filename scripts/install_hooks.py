@@ -36,16 +36,16 @@ echo -e "Found QGIS files in commit. Checking for passwords...${NC}"
 # Flag to track if we found any passwords
 FOUND_PASSWORDS=0
 
-# Check each staged QGIS file
-for FILE in $STAGED_QGIS_FILES; do
-    if [ -f "$FILE" ]; then
-        # Check if file contains passwords
-        if grep -E -q "password='[^']+'" "$FILE"; then
-            echo -e "ERROR: File $FILE contains passwords!${NC}"
-            FOUND_PASSWORDS=1
-        fi
-    fi
-done
+# Check all staged QGIS files with a single grep, passing the names NUL-separated
+# so paths with spaces survive
+FILES_WITH_PASSWORDS=$(git diff --cached --name-only -z --diff-filter=ACM | grep -z '\\.qgs$' | xargs -0 grep -lE "password='[^']+'" -- 2>/dev/null)
+
+if [ -n "$FILES_WITH_PASSWORDS" ]; then
+    while IFS= read -r FILE; do
+        echo -e "ERROR: File $FILE contains passwords!${NC}"
+    done <<< "$FILES_WITH_PASSWORDS"
+    FOUND_PASSWORDS=1
+fi
 
 # If we found passwords, clean the files and abort the commit
 if [ $FOUND_PASSWORDS -eq 1 ]; then
@@ -14,12 +14,70 @@ Generated with VS Code, Chat Mode Agent, Model: Claude Sonnet 4
 
 import os
 import re
+from operator import itemgetter
 from pathlib import Path
-from qgis.core import QgsProject, QgsLayerDefinition, QgsMessageLog, Qgis
+from qgis.core import (
+    QgsApplication, QgsProject, QgsLayerDefinition, QgsMessageLog, QgsPathResolver,
+    QgsReadWriteContext, QgsTask, Qgis
+)
+from qgis.PyQt.QtCore import QEventLoop
+from qgis.PyQt.QtXml import QDomDocument
 
 # Simple configuration - modify as needed
 QLR_FOLDER = "./data/topo_layers"
 
+# Layer number in lag{number}_{name}.qlr, or the old {number}_{name}.qlr pattern
+LAYER_NUMBER_PATTERN = re.compile(r'^(?:lag)?(\d+)_')
+
+def get_layer_number(filename):
+    """Extract the layer number from a .qlr filename, 999999 if it has none"""
+    match = LAYER_NUMBER_PATTERN.match(filename)
+    return int(match.group(1)) if match else 999999
+
+class QlrReadTask(QgsTask):
+    """Background task that reads and parses one .qlr file into a QDomDocument"""
+    
+    def __init__(self, qlr_file):
+        super().__init__(f"Reading {qlr_file.name}", QgsTask.CanCancel)
+        self.qlr_file = qlr_file
+        self.document = None
+        self.error = None
+    
+    def run(self):
+        try:
+            document = QDomDocument()
+            ok, error_message, line, column = document.setContent(self.qlr_file.read_bytes())
+        except Exception as e:
+            self.error = str(e)
+            return False
+        if not ok:
+            self.error = f"{error_message} (line {line}, column {column})"
+            return False
+        self.document = document
+        return True
+
+def read_qlr_files(qlr_files):
+    """Read and parse all .qlr files in parallel QGIS tasks, returning the tasks once all have finished"""
+    tasks = [QlrReadTask(qlr_file) for _, qlr_file in qlr_files]
+    
+    # Wait in a local event loop until every task has completed or failed
+    loop = QEventLoop()
+    pending = [len(tasks)]
+    
+    def task_finished():
+        pending[0] -= 1
+        if not pending[0]:
+            loop.quit()
+    
+    for task in tasks:
+        task.taskCompleted.connect(task_finished)
+        task.taskTerminated.connect(task_finished)
+        QgsApplication.taskManager().addTask(task)
+    
+    if pending[0]:
+        loop.exec_()
+    return tasks
+
 def load_qlr_files():
     """Load all .qlr files from folder into current project"""
     
@@ -30,46 +88,53 @@ def load_qlr_files():
         print(f"Error: Folder not found: {QLR_FOLDER}")
         return
     
-    # Find .qlr files and sort by number
-    qlr_files = list(folder.glob("*.qlr"))
+    # Find .qlr files and sort by layer number (high to low), extracting each number only once
+    qlr_files = sorted(
+        ((get_layer_number(entry.name), Path(entry.path))
+         for entry in os.scandir(folder) if entry.name.endswith('.qlr') and entry.is_file()),
+        key=itemgetter(0),
+        reverse=True
+    )
     
     if not qlr_files:
         print(f"No .qlr files found in {QLR_FOLDER}")
         return
     
-    # Sort by layer number (extract number from filename)
-    def get_layer_number(filename):
-        # Match pattern: lag{number}_{name}.qlr
-        match = re.match(r'^lag(\d+)_', filename)
-        if match:
-            return int(match.group(1))
-        # Fallback to old pattern: {number}_{name}.qlr
-        match_old = re.match(r'^(\d+)_', filename)
-        return int(match_old.group(1)) if match_old else 999999
-    
-    qlr_files.sort(key=lambda x: get_layer_number(x.name), reverse=True)
-    
     print(f"Loading {len(qlr_files)} .qlr files from topo_layers...")
     print("Layer order (high→low numbers, Arctic territories load first):")
     
+    # Read and parse the files in parallel, then add their layers one by one on the
+    # main thread (the only thread allowed to change the project) in layer order
+    tasks = read_qlr_files(qlr_files)
+    root = project.layerTreeRoot()
+    
     # Load each file
     loaded_count = 0
-    for i, qlr_file in enumerate(qlr_files, 1):
+    for i, ((layer_num, qlr_file), task) in enumerate(zip(qlr_files, tasks), 1):
         try:
-            layer_num = get_layer_number(qlr_file.name)
             layer_name = qlr_file.name.replace('.qlr', '').replace(f'lag{layer_num:02d}_', '')
             print(f"{i:2d}. lag{layer_num:02d}: {layer_name}")
             
-            result = QgsLayerDefinition.loadLayerDefinition(
-                str(qlr_file), 
-                project, 
-                project.layerTreeRoot()
+            if task.document is None:
+                print(f"    ✗ Failed to read {qlr_file.name}: {task.error}")
+                continue
+            
+            # Resolve relative datasource paths against the .qlr file, as loading it by path would
+            context = QgsReadWriteContext()
+            context.setPathResolver(QgsPathResolver(str(qlr_file)))
+            context.setProjectTranslator(project)
+            
+            result, error_message = QgsLayerDefinition.loadLayerDefinition(
+                task.document,
+                project,
+                root,
+                context
             )
             
             if result:
                 loaded_count += 1
             else:
-                print(f"    ✗ Failed to load {qlr_file.name}")
+                print(f"    ✗ Failed to load {qlr_file.name}: {error_message}")
                 
         except Exception as e:
             print(f"    ✗ Error loading {qlr_file.name}: {e}")